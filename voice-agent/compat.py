@@ -0,0 +1,28 @@
+"""
+═══════════════════════════════════════════════════════════════
+compat.py - Dependencias opcionales con respaldo
+═══════════════════════════════════════════════════════════════
+
+  - loads / dumps: orjson si está instalado, json de la stdlib si no.
+    dumps devuelve siempre str (los mensajes de control van como
+    frames de texto).
+  - njit: decorador de numba, o None si numba no está instalado.
+"""
+
+import json
+
+try:
+    import orjson
+
+    loads = orjson.loads
+
+    def dumps(obj) -> str:
+        return orjson.dumps(obj).decode()
+except ImportError:  # orjson es opcional; json de la stdlib como respaldo
+    loads = json.loads
+    dumps = json.dumps
+
+try:
+    from numba import njit
+except ImportError:  # numba es opcional; sin él se usa numpy vectorizado
+    njit = None
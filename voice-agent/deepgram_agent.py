@@ -18,16 +18,105 @@ maneja todo el pipeline voice-to-voice.
 """
 
 import os
-import json
+import time
+import socket
+import struct
 import asyncio
-from typing import Callable, Optional
+from collections import deque
+from typing import Callable, Mapping, Optional
 from loguru import logger
-import websockets
+import numpy as np
+import aiohttp
+from aiohttp import WSMsgType
+
+from compat import dumps as _dumps, loads as _loads, njit
 
 
 # URL del Voice Agent API v1 de Deepgram
 DEEPGRAM_AGENT_WS = "wss://agent.deepgram.com/agent"
 
+# Frame KeepAlive pre-serializado. Va como texto: Deepgram interpreta
+# los frames binarios como audio. Solo hace falta cuando no fluye audio
+# (Deepgram cierra la sesión tras ~10 s sin datos); el resto del tiempo
+# basta con el ping WebSocket. Con 5 s de inactividad más 1 s de
+# comprobación queda margen frente a los ~10 s aunque el writer vaya atrasado.
+_KEEPALIVE_MSG = _dumps({"type": "KeepAlive"})
+_KEEPALIVE_IDLE = 5.0
+# Cada cuánto se comprueba si la conexión está ociosa
+_KEEPALIVE_CHECK = 1.0
+
+# Agrupación del audio saliente: se acumulan chunks hasta ~60 ms antes
+# de enviarlos en un solo frame WebSocket. Un timer armado con el primer
+# chunk acota la latencia cuando el audio deja de llegar.
+_SEND_BATCH_SECONDS = 0.06
+
+# Buffer preasignado donde se acumula el audio saliente (se reutiliza
+# durante toda la llamada, sin asignaciones por chunk)
+_PCM_BUF_SIZE = 64 * 1024
+
+# Tamaño máximo de la cola de audio saliente. Si se llena (Deepgram
+# no drena a tiempo) se descarta el frame de audio más antiguo: el audio
+# viejo ya no sirve en una conversación en tiempo real. Los mensajes de
+# control van en su propia cola y nunca se descartan.
+_TX_QUEUE_SIZE = 256
+
+# Límite del handshake WebSocket/TLS con Deepgram (el timeout por defecto
+# de aiohttp es de 5 minutos)
+_CONNECT_TIMEOUT = 10.0
+
+# Tamaño máximo de un mensaje entrante de Deepgram. Los chunks TTS son
+# de unos pocos KB; 1 MiB deja margen sin aceptar los 4 MiB por defecto.
+_MAX_MSG_SIZE = 1 << 20
+
+# Buffer de envío TCP del socket Deepgram y límite del buffer del
+# transporte a partir del cual se descarta audio en vez de acumularlo.
+_SO_SNDBUF = 1 << 20
+_TRANSPORT_HIGH_WATER = 256 * 1024
+
+
+if njit is not None:
+    @njit(cache=True, fastmath=True)
+    def _prep_pcm(samples, gain):
+        """Aplicar ganancia con saturación a un buffer PCM int16."""
+        out = np.empty_like(samples)
+        for i in range(samples.shape[0]):
+            v = samples[i] * gain
+            if v > 32767.0:
+                v = 32767.0
+            elif v < -32768.0:
+                v = -32768.0
+            out[i] = np.int16(v)
+        return out
+
+    # Compilar al importar (con cache=True queda en disco) para que la
+    # primera llamada no pague el JIT en medio del audio
+    _prep_pcm(np.zeros(1, dtype=np.int16), 1.0)
+else:
+    def _prep_pcm(samples, gain):
+        """Aplicar ganancia con saturación a un buffer PCM int16."""
+        return np.clip(samples * gain, -32768, 32767).astype(np.int16)
+
+
+def _frame_binary(payload) -> bytes:
+    """
+    Construir un frame WebSocket binario cliente→servidor (RFC 6455).
+
+    FIN=1, opcode=0x2 y payload enmascarado como exige el RFC para los
+    frames que envía el cliente.
+    """
+    n = len(payload)
+    if n < 126:
+        header = struct.pack("!BB", 0x82, 0x80 | n)
+    elif n < 65536:
+        header = struct.pack("!BBH", 0x82, 0x80 | 126, n)
+    else:
+        header = struct.pack("!BBQ", 0x82, 0x80 | 127, n)
+    mask = os.urandom(4)
+    # XOR con la máscara vía enteros grandes (en C), sin loop por byte
+    key = (mask * (n // 4 + 1))[:n]
+    masked = (int.from_bytes(payload, "big") ^ int.from_bytes(key, "big")).to_bytes(n, "big")
+    return header + mask + masked
+
 
 class DeepgramVoiceAgent:
     """
@@ -37,67 +126,152 @@ class DeepgramVoiceAgent:
     junto con eventos de transcripción y estado de la conversación.
     """
 
-    def __init__(self):
-        self.api_key = os.getenv("DEEPGRAM_API_KEY", "")
-        self.language = os.getenv("AGENT_LANGUAGE", "es")
-        self.stt_model = os.getenv("DEEPGRAM_STT_MODEL", "nova-3")
-        self.llm_provider = os.getenv("DEEPGRAM_LLM_PROVIDER", "open_ai")
-        self.llm_model = os.getenv("DEEPGRAM_LLM_MODEL", "gpt-4o-mini")
-        self.tts_model = os.getenv("DEEPGRAM_TTS_MODEL", "aura-2-luna-es")
-        self.sample_rate = int(os.getenv("AUDIO_SAMPLE_RATE", "16000"))
-        self.encoding = os.getenv("AUDIO_ENCODING", "linear16")
-        self.system_prompt = os.getenv(
+    def __init__(self, env: Optional[Mapping[str, str]] = None):
+        """
+        Args:
+            env: Configuración (DEEPGRAM_*, AGENT_*, AUDIO_*); por defecto os.environ
+        """
+        get = (os.environ if env is None else env).get
+        self.api_key = get("DEEPGRAM_API_KEY", "")
+        self.language = get("AGENT_LANGUAGE", "es")
+        self.stt_model = get("DEEPGRAM_STT_MODEL", "nova-3")
+        self.llm_provider = get("DEEPGRAM_LLM_PROVIDER", "open_ai")
+        self.llm_model = get("DEEPGRAM_LLM_MODEL", "gpt-4o-mini")
+        self.tts_model = get("DEEPGRAM_TTS_MODEL", "aura-2-luna-es")
+        self.sample_rate = int(get("AUDIO_SAMPLE_RATE", "16000"))
+        self.encoding = get("AUDIO_ENCODING", "linear16")
+        self.input_gain = float(get("AUDIO_INPUT_GAIN", "1.0"))
+        self.system_prompt = get(
             "AGENT_SYSTEM_PROMPT",
             "Eres un asistente virtual de atención telefónica. "
             "Responde en español de forma breve, clara y profesional."
         )
-        self.greeting = os.getenv(
+        self.greeting = get(
             "AGENT_GREETING",
             "Hola, bienvenido. Soy el asistente virtual. ¿En qué puedo ayudarle?"
         )
 
-        self.ws: Optional[websockets.WebSocketClientProtocol] = None
+        # Settings se construye y serializa una sola vez; se reutiliza
+        # tal cual en cada (re)conexión. update_prompt lo modifica y
+        # lo marca para re-serializar.
+        self._settings = self._build_settings()
+        self._settings_payload: Optional[str] = _dumps(self._settings)
+
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.ws: Optional[aiohttp.ClientWebSocketResponse] = None
+        self._ws_open = False
+        self._transport: Optional[asyncio.Transport] = None
         self._listener_task: Optional[asyncio.Task] = None
         self._keepalive_task: Optional[asyncio.Task] = None
-
-        # Callbacks
-        self._on_audio_response: Optional[Callable] = None
-        self._on_transcript: Optional[Callable] = None
-        self._on_agent_text: Optional[Callable] = None
-        self._on_agent_thinking: Optional[Callable] = None
-        self._on_user_started_speaking: Optional[Callable] = None
-        self._on_agent_audio_done: Optional[Callable] = None
-        self._on_error: Optional[Callable] = None
+        self._writer_task: Optional[asyncio.Task] = None
+        self._json_task: Optional[asyncio.Task] = None
+        # Mensajes JSON pendientes de parsear/despachar (ver _json_worker)
+        self._json_queue: asyncio.Queue = asyncio.Queue()
+        # Frames salientes: control (str) y audio (bytes, acotada), más
+        # un Future para despertar al writer
+        self._tx_ctrl: deque = deque()
+        self._tx_audio: deque = deque()
+        self._tx_wake: Optional[asyncio.Future] = None
+
+        # Buffer de audio saliente pendiente de enviar
+        bytes_per_sample = 2 if self.encoding == "linear16" else 1
+        self._pcm_buf = bytearray(_PCM_BUF_SIZE)
+        self._pcm_view = memoryview(self._pcm_buf)
+        self._pcm_len = 0
+        # Timer de flush: solo existe mientras hay audio en el buffer
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._last_send_ts = 0.0
+        self._send_threshold = int(self.sample_rate * bytes_per_sample * _SEND_BATCH_SECONDS)
+
+        # Callbacks, guardados como (callback, es_corrutina) para no
+        # inspeccionar la función en cada evento
+        self._on_audio_response: Optional[tuple[Callable, bool]] = None
+        # ConversationText: callback por rol ("user" / "assistant")
+        self._role_callbacks: dict[str, tuple[Callable, bool]] = {}
+        self._on_agent_thinking: Optional[tuple[Callable, bool]] = None
+        self._on_user_started_speaking: Optional[tuple[Callable, bool]] = None
+        self._on_agent_audio_done: Optional[tuple[Callable, bool]] = None
+        self._on_error: Optional[tuple[Callable, bool]] = None
+        self._on_close: Optional[tuple[Callable, bool]] = None
+        # True desde que disconnect() empieza: el cierre es nuestro
+        self._closing = False
+
+        # Dispatch de eventos JSON por tipo de mensaje (un lookup por evento)
+        self._dispatch = {
+            "Welcome": self._handle_welcome,
+            "SettingsApplied": self._handle_settings_applied,
+            "ConversationText": self._handle_conversation_text,
+            "UserStartedSpeaking": self._handle_user_started_speaking,
+            "AgentThinking": self._handle_agent_thinking,
+            "AgentStartedSpeaking": self._handle_agent_started_speaking,
+            "AgentAudioDone": self._handle_agent_audio_done,
+            "Error": self._handle_error,
+            "Warning": self._handle_warning,
+        }
 
     # ── CONEXIÓN ─────────────────────────────────────────
 
-    async def connect(self):
-        """Conectar al Deepgram Voice Agent API."""
+    @property
+    def connected(self) -> bool:
+        """True mientras el WebSocket con Deepgram está abierto."""
+        return self._ws_open
+
+    async def connect(self, defer_greeting: bool = False):
+        """
+        Conectar al Deepgram Voice Agent API.
+
+        Args:
+            defer_greeting: Configurar la sesión sin saludo, para tenerla
+                pre-conectada antes de que llegue la llamada. El saludo
+                se reproduce después con greet().
+        """
         logger.info("Conectando a Deepgram Voice Agent API...")
 
         headers = {
             "Authorization": f"Token {self.api_key}",
         }
 
-        self.ws = await websockets.connect(
-            DEEPGRAM_AGENT_WS,
-            additional_headers=headers,
-            ping_interval=5,
-            ping_timeout=10,
-        )
-
-        logger.info("WebSocket Deepgram conectado")
-
-        # Enviar configuración del agente
-        await self._send_settings()
-
-        # Iniciar listener de eventos
+        # aiohttp parsea los frames en C; ``compress=0`` porque el PCM
+        # no se comprime y solo añadiría CPU por frame. aiohttp espera el
+        # PONG solo heartbeat/2 segundos: con 20 se mantienen los 10 s de
+        # margen de antes (los silencios ya los cubre el KeepAlive).
+        self._session = aiohttp.ClientSession()
+        try:
+            self.ws = await asyncio.wait_for(
+                self._session.ws_connect(
+                    DEEPGRAM_AGENT_WS,
+                    headers=headers,
+                    heartbeat=20,
+                    compress=0,
+                    max_msg_size=_MAX_MSG_SIZE,
+                ),
+                timeout=_CONNECT_TIMEOUT,
+            )
+            self._ws_open = True
+            self._setup_transport()
+
+            logger.info("WebSocket Deepgram conectado")
+
+            # Enviar configuración del agente
+            await self._send_settings(include_greeting=not defer_greeting)
+        except BaseException:
+            # También si se cancela (p. ej. apagado durante el warm-up del
+            # pool): no dejar el socket ni la ClientSession abiertos
+            self._ws_open = False
+            if self.ws is not None:
+                await self.ws.close()
+            await self._session.close()
+            raise
+
+        # Iniciar writer, listener de eventos y tareas periódicas
+        self._writer_task = asyncio.create_task(self._writer())
+        self._json_task = asyncio.create_task(self._json_worker())
         self._listener_task = asyncio.create_task(self._event_listener())
-        self._keepalive_task = asyncio.create_task(self._keepalive())
+        self._keepalive_task = asyncio.create_task(self._keepalive_loop())
 
-    async def _send_settings(self):
-        """Enviar mensaje Settings para configurar el agente."""
-        settings = {
+    def _build_settings(self) -> dict:
+        """Construir el mensaje Settings a partir de la configuración."""
+        return {
             "type": "Settings",
             "audio": {
                 "input": {
@@ -137,7 +311,17 @@ class DeepgramVoiceAgent:
             },
         }
 
-        await self.ws.send(json.dumps(settings))
+    async def _send_settings(self, include_greeting: bool = True):
+        """Enviar mensaje Settings para configurar el agente."""
+        if include_greeting:
+            if self._settings_payload is None:
+                self._settings_payload = _dumps(self._settings)
+            payload = self._settings_payload
+        else:
+            agent = {k: v for k, v in self._settings["agent"].items() if k != "greeting"}
+            payload = _dumps({**self._settings, "agent": agent})
+        await self.ws.send_str(payload)
+        self._last_send_ts = time.monotonic()
         logger.info(f"Settings enviados (STT={self.stt_model}, LLM={self.llm_model}, TTS={self.tts_model})")
 
     # ── ENVÍO DE AUDIO ───────────────────────────────────
@@ -146,155 +330,330 @@ class DeepgramVoiceAgent:
         """
         Enviar audio PCM del llamante a Deepgram.
 
+        El audio se acumula y se envía en bloques de ~60 ms para no
+        pagar el framing WebSocket/TLS por cada chunk de 20 ms.
+
         Args:
             audio_data: Audio PCM linear16, mono, al sample_rate configurado
         """
-        if self.ws and self.ws.open:
-            await self.ws.send(audio_data)
+        if not self._ws_open:
+            return
+
+        if self.input_gain != 1.0 and self.encoding == "linear16":
+            samples = np.frombuffer(audio_data, dtype=np.int16)
+            audio_data = _prep_pcm(samples, self.input_gain).view(np.uint8)
+
+        n = len(audio_data)
+        if self._pcm_len + n > _PCM_BUF_SIZE:
+            self._flush_audio()
+            if n > _PCM_BUF_SIZE:
+                # Chunk más grande que el buffer: se envía tal cual
+                self._enqueue(bytes(audio_data))
+                return
+
+        if not self._pcm_len:
+            self._flush_handle = asyncio.get_running_loop().call_later(
+                _SEND_BATCH_SECONDS, self._flush_audio)
+        end = self._pcm_len + n
+        self._pcm_view[self._pcm_len:end] = audio_data
+        self._pcm_len = end
+        if end >= self._send_threshold:
+            self._flush_audio()
+
+    def _flush_audio(self):
+        """Encolar el audio acumulado como un único frame."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._pcm_len:
+            return
+        # Única copia: el frame encolado no puede apuntar al buffer,
+        # que se reutiliza para los chunks siguientes
+        data = bytes(self._pcm_view[:self._pcm_len])
+        self._pcm_len = 0
+        self._enqueue(data)
+
+    async def _keepalive_loop(self):
+        """Enviar KeepAlive cuando la conexión está ociosa."""
+        while True:
+            try:
+                await asyncio.sleep(_KEEPALIVE_CHECK)
+                if self._ws_open and time.monotonic() - self._last_send_ts > _KEEPALIVE_IDLE:
+                    self._enqueue(_KEEPALIVE_MSG)
+            except Exception:
+                break
+
+    # ── ESCRITURA ────────────────────────────────────────
+
+    def _enqueue(self, frame):
+        """Encolar un frame para el writer sin esperar al envío."""
+        if isinstance(frame, bytes):
+            if len(self._tx_audio) >= _TX_QUEUE_SIZE:
+                self._tx_audio.popleft()
+                logger.debug("Cola de audio Deepgram llena, frame más antiguo descartado")
+            self._tx_audio.append(frame)
+        else:
+            self._tx_ctrl.append(frame)
+        wake = self._tx_wake
+        if wake is not None and not wake.done():
+            wake.set_result(None)
+
+    def _setup_transport(self):
+        """
+        Obtener el transporte del WebSocket para escribir el audio
+        directamente, sin pasar por la corrutina de envío de aiohttp.
+
+        aiohttp no expone el transporte como API pública: se lee de
+        ``ws._writer.transport`` solo si existe y tiene la forma esperada;
+        si no (otra versión de aiohttp), el audio va por send_bytes.
+        """
+        # SO_SNDBUF sí va por la API pública
+        sock = self.ws.get_extra_info("socket")
+        if sock is not None:
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, _SO_SNDBUF)
+            except OSError as e:
+                logger.debug(f"No se pudo ajustar SO_SNDBUF: {e}")
+
+        writer = getattr(self.ws, "_writer", None)
+        transport = getattr(writer, "transport", None)
+        if transport is None or not all(
+            hasattr(transport, name) for name in ("write", "is_closing", "get_write_buffer_size")
+        ):
+            logger.debug("Transporte Deepgram no accesible, se usa send_bytes")
+            transport = None
+        self._transport = transport
+
+    def _write_audio(self, data: bytes) -> bool:
+        """Escribir un frame de audio directamente en el transporte (False si se descarta)."""
+        transport = self._transport
+        if transport.is_closing():
+            raise ConnectionResetError("Transporte Deepgram cerrado")
+        if transport.get_write_buffer_size() > _TRANSPORT_HIGH_WATER:
+            logger.debug("Transporte Deepgram saturado, frame de audio descartado")
+            return False
+        transport.write(_frame_binary(data))
+        return True
+
+    async def _writer(self):
+        """
+        Única tarea que escribe en el WebSocket.
+
+        Los mensajes de control salen antes que el audio pendiente.
+        _last_send_ts se marca tras cada envío real (lo usa el KeepAlive).
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                if not self._tx_ctrl and not self._tx_audio:
+                    self._tx_wake = loop.create_future()
+                    await self._tx_wake
+                    self._tx_wake = None
+                while self._tx_ctrl:
+                    await self.ws.send_str(self._tx_ctrl.popleft())
+                    self._last_send_ts = time.monotonic()
+                if self._tx_audio:
+                    frame = self._tx_audio.popleft()
+                    if self._transport is None:
+                        await self.ws.send_bytes(frame)
+                    elif not self._write_audio(frame):
+                        continue
+                    self._last_send_ts = time.monotonic()
+        except ConnectionResetError:
+            self._ws_open = False
+        except Exception as e:
+            logger.error(f"Error en writer Deepgram: {e}")
 
     # ── CALLBACKS ────────────────────────────────────────
 
     def on_audio_response(self, callback: Callable):
         """Registrar callback para recibir audio PCM de respuesta del agente."""
-        self._on_audio_response = callback
+        self._on_audio_response = (callback, asyncio.iscoroutinefunction(callback))
 
     def on_transcript(self, callback: Callable):
         """Callback cuando se transcribe lo que dijo el usuario."""
-        self._on_transcript = callback
+        self._role_callbacks["user"] = (callback, asyncio.iscoroutinefunction(callback))
 
     def on_agent_text(self, callback: Callable):
         """Callback con el texto de la respuesta del agente."""
-        self._on_agent_text = callback
+        self._role_callbacks["assistant"] = (callback, asyncio.iscoroutinefunction(callback))
 
     def on_agent_thinking(self, callback: Callable):
         """Callback cuando el agente está procesando."""
-        self._on_agent_thinking = callback
+        self._on_agent_thinking = (callback, asyncio.iscoroutinefunction(callback))
 
     def on_user_started_speaking(self, callback: Callable):
         """Callback cuando se detecta que el usuario empezó a hablar."""
-        self._on_user_started_speaking = callback
+        self._on_user_started_speaking = (callback, asyncio.iscoroutinefunction(callback))
 
     def on_agent_audio_done(self, callback: Callable):
         """Callback cuando el agente terminó de hablar."""
-        self._on_agent_audio_done = callback
+        self._on_agent_audio_done = (callback, asyncio.iscoroutinefunction(callback))
 
     def on_error(self, callback: Callable):
         """Callback para errores."""
-        self._on_error = callback
+        self._on_error = (callback, asyncio.iscoroutinefunction(callback))
+
+    def on_close(self, callback: Callable):
+        """Callback cuando Deepgram cierra la conexión (no se llama tras disconnect())."""
+        self._on_close = (callback, asyncio.iscoroutinefunction(callback))
 
     # ── CONTROL ──────────────────────────────────────────
 
     async def inject_user_message(self, text: str):
         """Inyectar un mensaje de texto como si lo hubiera dicho el usuario."""
         msg = {"type": "InjectUserMessage", "content": text}
-        await self.ws.send(json.dumps(msg))
+        self._enqueue(_dumps(msg))
 
     async def inject_agent_message(self, text: str):
         """Inyectar un mensaje del agente (se sintetiza a audio)."""
         msg = {"type": "InjectAgentMessage", "message": text}
-        await self.ws.send(json.dumps(msg))
+        self._enqueue(_dumps(msg))
+
+    async def greet(self):
+        """Reproducir el saludo (sesiones conectadas con defer_greeting)."""
+        if self.greeting:
+            await self.inject_agent_message(self.greeting)
 
     async def update_prompt(self, new_prompt: str):
         """Actualizar el prompt del sistema en tiempo real."""
         msg = {"type": "UpdatePrompt", "prompt": new_prompt}
-        await self.ws.send(json.dumps(msg))
+        self._enqueue(_dumps(msg))
+
+        # Mantener el Settings cacheado al día para próximas conexiones;
+        # se re-serializa solo cuando haga falta enviarlo
+        self.system_prompt = new_prompt
+        self._settings["agent"]["think"]["prompt"] = new_prompt
+        self._settings_payload = None
 
     # ── LISTENER ─────────────────────────────────────────
 
     async def _event_listener(self):
-        """Escuchar eventos y audio del WebSocket de Deepgram."""
+        """
+        Escuchar eventos y audio del WebSocket de Deepgram.
+
+        El audio se entrega de inmediato; el texto JSON se encola para
+        _json_worker, así un callback lento no retrasa el audio.
+        """
         try:
-            async for message in self.ws:
+            async for msg in self.ws:
                 # Audio binario (respuesta TTS del agente)
-                if isinstance(message, bytes):
+                if msg.type == WSMsgType.BINARY:
                     if self._on_audio_response:
-                        if asyncio.iscoroutinefunction(self._on_audio_response):
-                            await self._on_audio_response(message)
+                        cb, is_coro = self._on_audio_response
+                        if is_coro:
+                            await cb(msg.data)
                         else:
-                            self._on_audio_response(message)
+                            cb(msg.data)
                     continue
 
-                # Mensajes JSON de control/eventos
-                data = json.loads(message)
-                msg_type = data.get("type", "")
-
-                if msg_type == "Welcome":
-                    logger.info(f"Deepgram Welcome: session={data.get('session_id')}")
-
-                elif msg_type == "SettingsApplied":
-                    logger.success("Deepgram: Settings aplicados correctamente")
-
-                elif msg_type == "ConversationText":
-                    role = data.get("role", "")
-                    content = data.get("content", "")
-                    logger.info(f"[{role}] {content}")
-
-                    if role == "user" and self._on_transcript:
-                        cb = self._on_transcript
-                        await cb(content) if asyncio.iscoroutinefunction(cb) else cb(content)
-
-                    elif role == "assistant" and self._on_agent_text:
-                        cb = self._on_agent_text
-                        await cb(content) if asyncio.iscoroutinefunction(cb) else cb(content)
-
-                elif msg_type == "UserStartedSpeaking":
-                    logger.debug("Usuario empezó a hablar")
-                    if self._on_user_started_speaking:
-                        cb = self._on_user_started_speaking
-                        await cb() if asyncio.iscoroutinefunction(cb) else cb()
-
-                elif msg_type == "AgentThinking":
-                    logger.debug("Agente procesando...")
-                    if self._on_agent_thinking:
-                        cb = self._on_agent_thinking
-                        await cb() if asyncio.iscoroutinefunction(cb) else cb()
-
-                elif msg_type == "AgentStartedSpeaking":
-                    logger.debug("Agente empezó a hablar")
-
-                elif msg_type == "AgentAudioDone":
-                    logger.debug("Agente terminó de hablar")
-                    if self._on_agent_audio_done:
-                        cb = self._on_agent_audio_done
-                        await cb() if asyncio.iscoroutinefunction(cb) else cb()
-
-                elif msg_type == "Error":
-                    desc = data.get("description", "error desconocido")
-                    code = data.get("code", "")
-                    logger.error(f"Deepgram error [{code}]: {desc}")
-                    if self._on_error:
-                        cb = self._on_error
-                        await cb(data) if asyncio.iscoroutinefunction(cb) else cb(data)
-
-                elif msg_type == "Warning":
-                    logger.warning(f"Deepgram warning: {data.get('description')}")
+                if msg.type != WSMsgType.TEXT:
+                    if msg.type == WSMsgType.ERROR:
+                        logger.error(f"Error en WebSocket Deepgram: {self.ws.exception()}")
+                        break
+                    continue
 
-                else:
-                    logger.debug(f"Deepgram evento: {msg_type}")
+                # Mensajes JSON de control/eventos
+                self._json_queue.put_nowait(msg.data)
 
-        except websockets.exceptions.ConnectionClosed as e:
-            logger.warning(f"WebSocket Deepgram cerrado: {e}")
+            logger.warning(f"WebSocket Deepgram cerrado (code={self.ws.close_code})")
         except Exception as e:
             logger.error(f"Error en listener Deepgram: {e}")
-
-    async def _keepalive(self):
-        """Enviar keep-alive periódico."""
+        finally:
+            self._ws_open = False
+
+        if self._on_close and not self._closing:
+            cb, is_coro = self._on_close
+            if is_coro:
+                await cb()
+            else:
+                cb()
+
+    async def _json_worker(self):
+        """Parsear y despachar los mensajes JSON encolados por el listener."""
         while True:
+            message = await self._json_queue.get()
             try:
-                await asyncio.sleep(5)
-                if self.ws and self.ws.open:
-                    await self.ws.send(json.dumps({"type": "KeepAlive"}))
-            except Exception:
-                break
+                data = _loads(message)
+                msg_type = data.get("type", "")
+
+                handler = self._dispatch.get(msg_type)
+                if handler:
+                    await handler(data)
+                else:
+                    logger.debug(f"Deepgram evento: {msg_type}")
+            except Exception as e:
+                logger.error(f"Error procesando evento Deepgram: {e}")
+
+    # ── HANDLERS DE EVENTOS ──────────────────────────────
+
+    async def _handle_welcome(self, data: dict):
+        logger.info(f"Deepgram Welcome: session={data.get('session_id')}")
+
+    async def _handle_settings_applied(self, data: dict):
+        logger.success("Deepgram: Settings aplicados correctamente")
+
+    async def _handle_conversation_text(self, data: dict):
+        role = data.get("role", "")
+        content = data.get("content", "")
+        logger.info(f"[{role}] {content}")
+
+        entry = self._role_callbacks.get(role)
+        if entry:
+            cb, is_coro = entry
+            await cb(content) if is_coro else cb(content)
+
+    async def _handle_user_started_speaking(self, data: dict):
+        logger.debug("Usuario empezó a hablar")
+        if self._on_user_started_speaking:
+            cb, is_coro = self._on_user_started_speaking
+            await cb() if is_coro else cb()
+
+    async def _handle_agent_thinking(self, data: dict):
+        logger.debug("Agente procesando...")
+        if self._on_agent_thinking:
+            cb, is_coro = self._on_agent_thinking
+            await cb() if is_coro else cb()
+
+    async def _handle_agent_started_speaking(self, data: dict):
+        logger.debug("Agente empezó a hablar")
+
+    async def _handle_agent_audio_done(self, data: dict):
+        logger.debug("Agente terminó de hablar")
+        if self._on_agent_audio_done:
+            cb, is_coro = self._on_agent_audio_done
+            await cb() if is_coro else cb()
+
+    async def _handle_error(self, data: dict):
+        desc = data.get("description", "error desconocido")
+        code = data.get("code", "")
+        logger.error(f"Deepgram error [{code}]: {desc}")
+        if self._on_error:
+            cb, is_coro = self._on_error
+            await cb(data) if is_coro else cb(data)
+
+    async def _handle_warning(self, data: dict):
+        logger.warning(f"Deepgram warning: {data.get('description')}")
 
     # ── DESCONEXIÓN ──────────────────────────────────────
 
     async def disconnect(self):
         """Cerrar conexión con Deepgram."""
+        self._closing = True
+        self._ws_open = False
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
         if self._keepalive_task:
             self._keepalive_task.cancel()
         if self._listener_task:
             self._listener_task.cancel()
+        if self._json_task:
+            self._json_task.cancel()
+        if self._writer_task:
+            self._writer_task.cancel()
         if self.ws:
             await self.ws.close()
+        if self._session:
+            await self._session.close()
         logger.info("Desconectado de Deepgram")
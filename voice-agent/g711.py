@@ -0,0 +1,207 @@
+"""
+═══════════════════════════════════════════════════════════════
+g711.py - Conversión G.711 (PCMU/PCMA) ↔ PCM16
+═══════════════════════════════════════════════════════════════
+
+El audio RTP de la UCM6302 viaja en G.711 (μ-law o A-law, 8 kHz,
+160 muestras por frame de 20 ms). Estas funciones lo convierten
+a/desde PCM lineal de 16 bits para Deepgram, remuestreando si Deepgram
+trabaja a un múltiplo entero de 8 kHz (16000, 24000, 48000...).
+
+Las conversiones son lookups sobre tablas precalculadas al importar.
+Con numba los kernels se compilan con @njit; sin numba se usa
+indexado vectorizado de numpy (mismo resultado).
+"""
+
+import numpy as np
+
+from compat import njit
+
+
+# Frecuencia de muestreo de G.711
+RATE = 8000
+
+
+# ── TABLAS ───────────────────────────────────────────────
+# Algoritmo de referencia G.711 (implementación de Sun Microsystems),
+# usado solo para construir las tablas al importar.
+
+_SEG_UEND = (0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF, 0x1FFF)
+_SEG_AEND = (0x1F, 0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF)
+
+
+def _segment(val: int, table) -> int:
+    for i, end in enumerate(table):
+        if val <= end:
+            return i
+    return len(table)
+
+
+def _ulaw_encode_ref(pcm14: int) -> int:
+    """PCM de 14 bits (con signo) → byte μ-law."""
+    if pcm14 < 0:
+        pcm14 = -pcm14
+        mask = 0x7F
+    else:
+        mask = 0xFF
+    pcm14 = min(pcm14, 8159) + 0x21
+    seg = _segment(pcm14, _SEG_UEND)
+    if seg >= 8:
+        return 0x7F ^ mask
+    return ((seg << 4) | ((pcm14 >> (seg + 1)) & 0xF)) ^ mask
+
+
+def _ulaw_decode_ref(u_val: int) -> int:
+    """Byte μ-law → PCM16."""
+    u_val = ~u_val & 0xFF
+    t = (((u_val & 0x0F) << 3) + 0x84) << ((u_val & 0x70) >> 4)
+    return (0x84 - t) if (u_val & 0x80) else (t - 0x84)
+
+
+def _alaw_encode_ref(pcm13: int) -> int:
+    """PCM de 13 bits (con signo) → byte A-law."""
+    if pcm13 >= 0:
+        mask = 0xD5
+    else:
+        mask = 0x55
+        pcm13 = -pcm13 - 1
+    seg = _segment(pcm13, _SEG_AEND)
+    if seg >= 8:
+        return 0x7F ^ mask
+    aval = seg << 4
+    aval |= ((pcm13 >> 1) if seg < 2 else (pcm13 >> seg)) & 0xF
+    return aval ^ mask
+
+
+def _alaw_decode_ref(a_val: int) -> int:
+    """Byte A-law → PCM16."""
+    a_val ^= 0x55
+    t = (a_val & 0x0F) << 4
+    seg = (a_val & 0x70) >> 4
+    if seg == 0:
+        t += 8
+    elif seg == 1:
+        t += 0x108
+    else:
+        t = (t + 0x108) << (seg - 1)
+    return t if (a_val & 0x80) else -t
+
+
+# Decodificación: 256 entradas (una por byte G.711)
+_ULAW_DECODE = np.array([_ulaw_decode_ref(i) for i in range(256)], dtype=np.int16)
+_ALAW_DECODE = np.array([_alaw_decode_ref(i) for i in range(256)], dtype=np.int16)
+
+# Codificación: indexadas por la muestra reducida a 14 bits (μ-law) o
+# 13 bits (A-law), desplazada para que el índice sea no negativo
+_ULAW_ENCODE = np.array([_ulaw_encode_ref(v) for v in range(-8192, 8192)], dtype=np.uint8)
+_ALAW_ENCODE = np.array([_alaw_encode_ref(v) for v in range(-4096, 4096)], dtype=np.uint8)
+
+
+# ── KERNELS ──────────────────────────────────────────────
+
+if njit is not None:
+    @njit(cache=True)
+    def ulaw_to_pcm16(buf):
+        """Array uint8 μ-law → array int16 PCM."""
+        out = np.empty(buf.shape[0], dtype=np.int16)
+        for i in range(buf.shape[0]):
+            out[i] = _ULAW_DECODE[buf[i]]
+        return out
+
+    @njit(cache=True)
+    def alaw_to_pcm16(buf):
+        """Array uint8 A-law → array int16 PCM."""
+        out = np.empty(buf.shape[0], dtype=np.int16)
+        for i in range(buf.shape[0]):
+            out[i] = _ALAW_DECODE[buf[i]]
+        return out
+
+    @njit(cache=True)
+    def pcm16_to_ulaw(samples):
+        """Array int16 PCM → array uint8 μ-law."""
+        out = np.empty(samples.shape[0], dtype=np.uint8)
+        for i in range(samples.shape[0]):
+            out[i] = _ULAW_ENCODE[(samples[i] >> 2) + 8192]
+        return out
+
+    @njit(cache=True)
+    def pcm16_to_alaw(samples):
+        """Array int16 PCM → array uint8 A-law."""
+        out = np.empty(samples.shape[0], dtype=np.uint8)
+        for i in range(samples.shape[0]):
+            out[i] = _ALAW_ENCODE[(samples[i] >> 3) + 4096]
+        return out
+else:
+    def ulaw_to_pcm16(buf):
+        """Array uint8 μ-law → array int16 PCM."""
+        return _ULAW_DECODE[buf]
+
+    def alaw_to_pcm16(buf):
+        """Array uint8 A-law → array int16 PCM."""
+        return _ALAW_DECODE[buf]
+
+    def pcm16_to_ulaw(samples):
+        """Array int16 PCM → array uint8 μ-law."""
+        return _ULAW_ENCODE[(samples >> 2) + 8192]
+
+    def pcm16_to_alaw(samples):
+        """Array int16 PCM → array uint8 A-law."""
+        return _ALAW_ENCODE[(samples >> 3) + 4096]
+
+
+_DECODERS = {"pcmu": ulaw_to_pcm16, "pcma": alaw_to_pcm16}
+_ENCODERS = {"pcmu": pcm16_to_ulaw, "pcma": pcm16_to_alaw}
+CODECS = tuple(_ENCODERS)
+
+
+# ── REMUESTREO ───────────────────────────────────────────
+# Solo factores enteros: interpolación lineal al subir, media de cada
+# grupo de `factor` muestras al bajar (filtro paso bajo sencillo).
+
+def _upsample(samples, factor: int):
+    n = samples.shape[0]
+    x = np.arange(n * factor) / factor
+    return np.interp(x, np.arange(n), samples).astype(np.int16)
+
+
+def _downsample(samples, factor: int):
+    n = samples.shape[0] // factor
+    groups = samples[:n * factor].reshape(n, factor).astype(np.int32)
+    return (groups.sum(axis=1) // factor).astype(np.int16)
+
+
+def _factor(rate: int) -> int:
+    if rate % RATE:
+        raise ValueError(f"{rate} Hz no es múltiplo de {RATE} Hz")
+    return rate // RATE
+
+
+# ── API ──────────────────────────────────────────────────
+
+def decode(payload: bytes, codec: str = "pcmu", rate: int = RATE) -> bytes:
+    """Payload RTP G.711 → PCM16 little-endian a `rate` Hz."""
+    buf = np.frombuffer(payload, dtype=np.uint8)
+    samples = _DECODERS[codec](buf)
+    factor = _factor(rate)
+    if factor > 1:
+        samples = _upsample(samples, factor)
+    return samples.tobytes()
+
+
+def encode(pcm: bytes, codec: str = "pcmu", rate: int = RATE) -> bytes:
+    """PCM16 little-endian a `rate` Hz → payload RTP G.711."""
+    samples = np.frombuffer(pcm, dtype=np.int16)
+    factor = _factor(rate)
+    if factor > 1:
+        samples = _downsample(samples, factor)
+    return _ENCODERS[codec](samples).tobytes()
+
+
+def warmup():
+    """
+    Compilar los kernels de antemano con un frame vacío de 20 ms,
+    para que el JIT no se pague en el primer frame de la primera llamada.
+    """
+    silence = np.zeros(160, dtype=np.int16)
+    for codec in _ENCODERS:
+        _DECODERS[codec](_ENCODERS[codec](silence))
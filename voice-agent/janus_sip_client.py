@@ -10,12 +10,19 @@ Maneja la conexión WebSocket con Janus Gateway para:
   4. Gestionar señalización SDP y flujo de audio
 """
 
-import json
 import asyncio
-import uuid
+import itertools
+import secrets
+from collections import deque
 from loguru import logger
 import websockets
 
+from compat import dumps as _dumps, loads as _loads
+
+
+# Tamaño máximo de la cola de mensajes salientes hacia Janus
+_TX_QUEUE_SIZE = 256
+
 
 class JanusSIPClient:
     """Cliente asíncrono para el plugin SIP de Janus via WebSocket."""
@@ -24,29 +31,59 @@ class JanusSIPClient:
         self.ws_url = ws_url
         self.api_secret = api_secret
         self.ws = None
+        self._loop = None
         self.session_id = None
         self.handle_id = None
         self.transactions = {}
+        # IDs de transacción: prefijo aleatorio por cliente + contador
+        self._tx_prefix = secrets.token_hex(3)
+        self._tx_counter = itertools.count()
         self.event_handlers = {}
         self._keepalive_task = None
         self._listener_task = None
+        self._writer_task = None
+        # Mensajes salientes: deque + Future de despertar para el writer
+        self._outq = deque()
+        self._writer_wake = None
+        # Motivo del cierre del WebSocket (para fallar las peticiones)
+        self._closed_exc = None
+
+        # Handlers async pendientes: un único worker los drena en orden
+        self._event_deque = deque()
+        self._event_waiter = None
+        self._event_worker_task = None
+
+        # Dispatch por campo "janus" de los mensajes que no son respuesta
+        self._dispatch = {
+            "event": self._handle_plugin_event,
+            "webrtcup": self._handle_webrtcup,
+            "media": self._handle_media,
+            "hangup": self._handle_hangup,
+        }
 
     # ── CONEXIÓN ─────────────────────────────────────────
 
     async def connect(self):
         """Conectar al WebSocket de Janus y crear sesión."""
         logger.info(f"Conectando a Janus: {self.ws_url}")
+        self._loop = asyncio.get_running_loop()
         self.ws = await websockets.connect(
             self.ws_url,
             subprotocols=["janus-protocol"],
             ping_interval=30,
             ping_timeout=10,
+            # Solo mensajes JSON pequeños: permessage-deflate no compensa
+            compression=None,
         )
+        self._writer_task = asyncio.create_task(self._writer())
+        # El listener tiene que estar corriendo antes de la primera
+        # petición: es quien resuelve las respuestas
+        self._event_worker_task = asyncio.create_task(self._event_worker())
+        self._listener_task = asyncio.create_task(self._event_listener())
 
         self.session_id = await self._create_session()
         logger.info(f"Sesión Janus creada: {self.session_id}")
 
-        self._listener_task = asyncio.create_task(self._event_listener())
         self._keepalive_task = asyncio.create_task(self._keepalive())
         return self.session_id
 
@@ -121,13 +158,52 @@ class JanusSIPClient:
                  accepted, hangup, calling, ringing, progress,
                  jsep, webrtcup, media
         """
-        self.event_handlers[event_type] = handler
+        self.event_handlers[event_type] = (handler, asyncio.iscoroutinefunction(handler))
+
+    def set_event_map(self, owner, mapping: dict):
+        """
+        Registrar de una vez varios handlers de un objeto.
+
+        Args:
+            owner: Objeto que implementa los handlers
+            mapping: {evento: nombre del método de `owner`}
+        """
+        for event_type, method_name in mapping.items():
+            self.on_event(event_type, getattr(owner, method_name))
+
+    def _fire(self, event_type: str, *args):
+        """Invocar el handler registrado (si existe) para un evento."""
+        entry = self.event_handlers.get(event_type)
+        if entry:
+            h, is_coro = entry
+            if not is_coro:
+                h(*args)
+                return
+            self._event_deque.append((h, args))
+            waiter = self._event_waiter
+            if waiter is not None and not waiter.done():
+                waiter.set_result(None)
+
+    async def _event_worker(self):
+        """Ejecutar en orden los handlers async encolados por _fire."""
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self._event_deque:
+                self._event_waiter = loop.create_future()
+                await self._event_waiter
+                self._event_waiter = None
+            while self._event_deque:
+                h, args = self._event_deque.popleft()
+                try:
+                    await h(*args)
+                except Exception as e:
+                    logger.error(f"Error en handler {getattr(h, '__name__', h)}: {e}")
 
     async def _event_listener(self):
         """Loop principal de escucha de eventos del WebSocket."""
         try:
             async for message in self.ws:
-                data = json.loads(message)
+                data = _loads(message)
                 janus_type = data.get("janus")
 
                 # Respuestas a transacciones pendientes
@@ -138,53 +214,69 @@ class JanusSIPClient:
                         fut.set_result(data)
                     continue
 
-                # Eventos del plugin SIP
-                if janus_type == "event":
-                    pd = data.get("plugindata", {}).get("data", {})
-                    result = pd.get("result", {})
-                    ev = result.get("event") or pd.get("event")
-
-                    if ev and ev in self.event_handlers:
-                        h = self.event_handlers[ev]
-                        asyncio.create_task(h(data)) if asyncio.iscoroutinefunction(h) else h(data)
-
-                    # JSEP (SDP offer/answer)
-                    jsep = data.get("jsep")
-                    if jsep and "jsep" in self.event_handlers:
-                        h = self.event_handlers["jsep"]
-                        asyncio.create_task(h(jsep, data)) if asyncio.iscoroutinefunction(h) else h(jsep, data)
-
-                elif janus_type == "webrtcup":
-                    logger.info("WebRTC PeerConnection activa")
-                    if "webrtcup" in self.event_handlers:
-                        h = self.event_handlers["webrtcup"]
-                        asyncio.create_task(h(data)) if asyncio.iscoroutinefunction(h) else h(data)
-
-                elif janus_type == "media":
-                    logger.debug(f"Media {data.get('type')}: receiving={data.get('receiving')}")
-
-                elif janus_type == "hangup":
-                    logger.info(f"Hangup: {data.get('reason', '?')}")
-                    if "hangup" in self.event_handlers:
-                        h = self.event_handlers["hangup"]
-                        asyncio.create_task(h(data)) if asyncio.iscoroutinefunction(h) else h(data)
-
-        except websockets.exceptions.ConnectionClosed:
+                handler = self._dispatch.get(janus_type)
+                if handler:
+                    handler(data)
+            exc = None
+
+        except websockets.exceptions.ConnectionClosed as e:
             logger.warning("WebSocket Janus desconectado")
+            exc = e
         except Exception as e:
             logger.error(f"Error en listener: {e}")
+            exc = e
+
+        # Sin listener ya no llegan respuestas: se detiene el writer,
+        # que al salir falla las transacciones pendientes
+        self._closed_exc = exc
+        if self._writer_task:
+            self._writer_task.cancel()
+
+    def _handle_plugin_event(self, data: dict):
+        """Eventos del plugin SIP (y su JSEP, si lo trae)."""
+        pd = data.get("plugindata", {}).get("data", {})
+        result = pd.get("result", {})
+        ev = result.get("event") or pd.get("event")
+
+        if ev:
+            self._fire(ev, data)
+
+        # JSEP (SDP offer/answer)
+        jsep = data.get("jsep")
+        if jsep:
+            self._fire("jsep", jsep, data)
+
+    def _handle_webrtcup(self, data: dict):
+        logger.info("WebRTC PeerConnection activa")
+        self._fire("webrtcup", data)
+
+    def _handle_media(self, data: dict):
+        logger.debug(f"Media {data.get('type')}: receiving={data.get('receiving')}")
+
+    def _handle_hangup(self, data: dict):
+        logger.info(f"Hangup: {data.get('reason', '?')}")
+        self._fire("hangup", data)
 
     # ── COMUNICACIÓN INTERNA ─────────────────────────────
 
     async def _send_request(self, msg: dict, timeout: float = 10.0) -> dict:
-        tx = str(uuid.uuid4())[:12]
+        if self._writer_task is None or self._writer_task.done():
+            raise self._closed_error()
+
+        tx = f"{self._tx_prefix}{next(self._tx_counter):x}"
         msg["transaction"] = tx
         if self.api_secret:
             msg["apisecret"] = self.api_secret
 
-        fut = asyncio.get_event_loop().create_future()
+        fut = self._loop.create_future()
         self.transactions[tx] = fut
-        await self.ws.send(json.dumps(msg))
+        if len(self._outq) >= _TX_QUEUE_SIZE:
+            self.transactions.pop(tx, None)
+            raise Exception("Cola de envío a Janus llena")
+        self._outq.append(_dumps(msg))
+        wake = self._writer_wake
+        if wake is not None and not wake.done():
+            wake.set_result(None)
 
         try:
             result = await asyncio.wait_for(fut, timeout=timeout)
@@ -206,6 +298,44 @@ class JanusSIPClient:
             msg["jsep"] = jsep
         return await self._send_request(msg, timeout=30.0)
 
+    async def _writer(self):
+        """
+        Única tarea que escribe en el WebSocket.
+
+        Espera a que haya mensajes y los envía todos seguidos en el mismo
+        ciclo de despertar (Janus exige un mensaje JSON por frame).
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                if not self._outq:
+                    self._writer_wake = loop.create_future()
+                    await self._writer_wake
+                    self._writer_wake = None
+                while self._outq:
+                    await self.ws.send(self._outq.popleft())
+        except websockets.exceptions.ConnectionClosed as e:
+            self._closed_exc = e
+        except Exception as e:
+            logger.error(f"Error en writer Janus: {e}")
+            self._closed_exc = e
+        finally:
+            # Nada más se va a enviar: las peticiones en vuelo (incluida
+            # la que estaba enviándose) fallan ya en vez de esperar su timeout
+            self._outq.clear()
+            self._fail_pending(self._closed_error())
+
+    def _closed_error(self) -> ConnectionError:
+        reason = f": {self._closed_exc}" if self._closed_exc else ""
+        return ConnectionError(f"WebSocket Janus cerrado{reason}")
+
+    def _fail_pending(self, exc: Exception):
+        """Fallar todas las transacciones pendientes con `exc`."""
+        pending, self.transactions = self.transactions, {}
+        for fut in pending.values():
+            if not fut.done():
+                fut.set_exception(exc)
+
     async def _keepalive(self):
         while True:
             try:
@@ -221,9 +351,8 @@ class JanusSIPClient:
     async def disconnect(self):
         if self._keepalive_task:
             self._keepalive_task.cancel()
-        if self._listener_task:
-            self._listener_task.cancel()
         if self.ws:
+            # Con el listener aún activo, para que llegue la respuesta
             try:
                 await self._send_request({
                     "janus": "destroy",
@@ -231,5 +360,9 @@ class JanusSIPClient:
                 })
             except Exception:
                 pass
+        for task in (self._listener_task, self._event_worker_task, self._writer_task):
+            if task:
+                task.cancel()
+        if self.ws:
             await self.ws.close()
         logger.info("Desconectado de Janus")
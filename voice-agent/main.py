@@ -35,25 +35,93 @@ del PeerConnection de Janus.
 """
 
 import os
+import sys
 import asyncio
 import signal
-from dotenv import load_dotenv
+from dotenv import dotenv_values
 from loguru import logger
 
+import g711
 from janus_sip_client import JanusSIPClient
 from deepgram_agent import DeepgramVoiceAgent
 
-load_dotenv()
+try:
+    import uvloop
+except ImportError:  # uvloop es opcional (no disponible en Windows)
+    uvloop = None
 
 # ── CONFIGURACIÓN ────────────────────────────────────────
 
-UCM_HOST = os.getenv("UCM_HOST", "192.168.1.100")
-UCM_PORT = int(os.getenv("UCM_PORT", "5060"))
-SIP_EXTENSION = os.getenv("SIP_EXTENSION", "9000")
-SIP_PASSWORD = os.getenv("SIP_PASSWORD", "")
-SIP_DISPLAY_NAME = os.getenv("SIP_DISPLAY_NAME", "Agente IA")
-JANUS_WS_URL = os.getenv("JANUS_WS_URL", "ws://127.0.0.1:8188")
-JANUS_API_SECRET = os.getenv("JANUS_API_SECRET", "")
+# .env parseado una sola vez a un dict; las variables de entorno reales
+# (p. ej. las de docker-compose) tienen prioridad. No se modifica os.environ:
+# la configuración se pasa explícitamente a DeepgramVoiceAgent. Las claves
+# sin valor (``CLAVE`` sin ``=``) se ignoran, como hacía load_dotenv.
+_env = {
+    **{k: v for k, v in dotenv_values().items() if v is not None},
+    **os.environ,
+}
+_get = _env.get
+
+UCM_HOST = _get("UCM_HOST", "192.168.1.100")
+UCM_PORT = int(_get("UCM_PORT", "5060"))
+SIP_EXTENSION = _get("SIP_EXTENSION", "9000")
+SIP_PASSWORD = _get("SIP_PASSWORD", "")
+SIP_DISPLAY_NAME = _get("SIP_DISPLAY_NAME", "Agente IA")
+JANUS_WS_URL = _get("JANUS_WS_URL", "ws://127.0.0.1:8188")
+JANUS_API_SECRET = _get("JANUS_API_SECRET", "")
+USE_UVLOOP = _get("USE_UVLOOP", "1") != "0"
+AUDIO_SAMPLE_RATE = int(_get("AUDIO_SAMPLE_RATE", "16000"))
+AUDIO_ENCODING = _get("AUDIO_ENCODING", "linear16")
+
+# Sesiones Deepgram pre-conectadas en espera de llamada (0 = sin pool).
+# Cada una es una sesión de Voice Agent abierta mientras espera, que
+# Deepgram puede facturar por minuto aunque no llegue ninguna llamada.
+DEEPGRAM_POOL_SIZE = int(_get("DEEPGRAM_POOL_SIZE", "0"))
+
+# Segundos de audio TTS que retiene el buffer circular hacia el llamante.
+# Deepgram envía el TTS más rápido que tiempo real y el pacer lo drena a
+# tiempo real: el buffer debe caber una respuesta completa.
+TTS_BUFFER_SECONDS = int(_get("TTS_BUFFER_SECONDS", "30"))
+
+# ptime RTP (ms): el audio TTS sale hacia el llamante en frames de este tamaño
+RTP_PTIME_MS = int(_get("RTP_PTIME_MS", "20"))
+
+# Codec G.711 negociado con la UCM (pcmu / pcma). Con linear16 el audio se
+# transcodifica (y remuestrea de/a 8 kHz); con mulaw/alaw pasa tal cual.
+# _check_audio_config() rechaza al arrancar lo que el bridge no soporta.
+RTP_CODEC = _get("RTP_CODEC", "pcmu").lower()
+TRANSCODE_G711 = AUDIO_ENCODING == "linear16"
+
+# AUDIO_ENCODING de Deepgram equivalente a cada codec G.711 (sin transcodificar)
+_G711_ENCODINGS = {"pcmu": "mulaw", "pcma": "alaw"}
+
+
+def _check_audio_config():
+    """Salir si la combinación de audio no la puede manejar el bridge RTP."""
+    problem = None
+    if RTP_CODEC not in g711.CODECS:
+        problem = f"RTP_CODEC inválido: {RTP_CODEC!r} (usar pcmu o pcma)"
+    elif AUDIO_ENCODING == "linear16":
+        if AUDIO_SAMPLE_RATE % g711.RATE:
+            problem = (f"AUDIO_SAMPLE_RATE={AUDIO_SAMPLE_RATE} no es múltiplo de "
+                       f"{g711.RATE} Hz (G.711): no se puede remuestrear")
+    elif AUDIO_ENCODING != _G711_ENCODINGS[RTP_CODEC]:
+        problem = (f"AUDIO_ENCODING={AUDIO_ENCODING} no coincide con RTP_CODEC={RTP_CODEC} "
+                   f"(usar linear16 o {_G711_ENCODINGS[RTP_CODEC]})")
+    elif AUDIO_SAMPLE_RATE != g711.RATE:
+        problem = (f"AUDIO_ENCODING={AUDIO_ENCODING} sin transcodificar requiere "
+                   f"AUDIO_SAMPLE_RATE={g711.RATE}")
+    if problem:
+        logger.error(f"❌ Configuración de audio no soportada: {problem}")
+        sys.exit(1)
+
+
+def _result(data) -> dict:
+    """Extraer ``plugindata.data.result`` de un evento SIP de Janus ({} si falta)."""
+    try:
+        return data["plugindata"]["data"]["result"]
+    except (KeyError, TypeError):
+        return {}
 
 
 class VoiceAgentService:
@@ -67,10 +135,41 @@ class VoiceAgentService:
       - Bridge de audio bidireccional
     """
 
+    # Evento SIP de Janus → nombre del método handler
+    EVENT_HANDLERS = {
+        "registered": "_on_registered",
+        "registration_failed": "_on_registration_failed",
+        "incomingcall": "_on_incoming_call",
+        "accepted": "_on_call_accepted",
+        "hangup": "_on_hangup",
+        "calling": "_on_calling",
+        "ringing": "_on_ringing",
+    }
+
     def __init__(self):
         self.janus = JanusSIPClient(JANUS_WS_URL, JANUS_API_SECRET)
         self.deepgram: DeepgramVoiceAgent = None
-        self.running = True
+        self._dg_pool: list[DeepgramVoiceAgent] = []
+        # Sesiones del pool que Deepgram cerró; se liberan en el próximo warm-up
+        self._dg_closed: list[DeepgramVoiceAgent] = []
+        self._pool_task: asyncio.Task = None
+        self._stop_event = asyncio.Event()
+        self._startup_task: asyncio.Task = None
+        self._shutdown_started = False
+
+        # Buffer circular (FIFO acotado) para el audio TTS de Deepgram:
+        # preasignado y reutilizado entre llamadas; si se llena se
+        # descarta lo más antiguo y se conserva lo más reciente.
+        bytes_per_sample = 2 if AUDIO_ENCODING == "linear16" else 1
+        self._tts_ring = bytearray(TTS_BUFFER_SECONDS * AUDIO_SAMPLE_RATE * bytes_per_sample)
+        self._tts_view = memoryview(self._tts_ring)
+        self._tts_head = 0   # próxima posición de lectura
+        self._tts_tail = 0   # próxima posición de escritura
+        self._tts_size = 0   # bytes almacenados
+        self._tts_frame_bytes = AUDIO_SAMPLE_RATE * bytes_per_sample * RTP_PTIME_MS // 1000
+        self._pacer_task: asyncio.Task = None
+        # Destino de los frames RTP hacia el llamante (ver set_rtp_sink)
+        self._rtp_sink = None
         self.in_call = False
 
     async def start(self):
@@ -79,6 +178,26 @@ class VoiceAgentService:
         logger.info("  VOICE AGENT: Janus + UCM6302 + Deepgram")
         logger.info("=" * 60)
 
+        _check_audio_config()
+        if TRANSCODE_G711:
+            # Compilar los kernels G.711 antes de la primera llamada
+            g711.warmup()
+
+        # El arranque va en su propia Task para que stop() pueda cancelarlo:
+        # connect/register pueden tardar hasta sus timeouts
+        self._startup_task = asyncio.create_task(self._startup())
+        try:
+            await self._startup_task
+            # Mantener el servicio activo
+            logger.info("Esperando llamadas...")
+            await self._stop_event.wait()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            await self.shutdown()
+
+    async def _startup(self):
+        """Conectar a Janus, registrar la extensión y lanzar el pool Deepgram."""
         # 1. Conectar a Janus Gateway
         logger.info("[1/3] Conectando a Janus Gateway...")
         await self.janus.connect()
@@ -88,8 +207,11 @@ class VoiceAgentService:
         logger.info("[2/3] Configurando handlers de eventos...")
         self._setup_sip_handlers()
 
-        # 3. Registrar extensión en la UCM6302
+        # 3. Registrar extensión en la UCM6302. Las sesiones Deepgram se
+        #    pre-conectan en segundo plano (no dependen del registro): no
+        #    se esperan aquí, para que una señal de parada actúe ya
         logger.info(f"[3/3] Registrando ext {SIP_EXTENSION} en UCM6302 ({UCM_HOST})...")
+        self._pool_task = asyncio.create_task(self._warm_dg_pool())
         await self.janus.register(
             ucm_host=UCM_HOST,
             ucm_port=UCM_PORT,
@@ -98,39 +220,21 @@ class VoiceAgentService:
             display_name=SIP_DISPLAY_NAME,
         )
 
-        # Mantener el servicio activo
-        logger.info("Esperando llamadas...")
-        try:
-            while self.running:
-                await asyncio.sleep(1)
-        except asyncio.CancelledError:
-            pass
-        finally:
-            await self.shutdown()
-
     def _setup_sip_handlers(self):
         """Configurar handlers para eventos SIP de Janus."""
-        self.janus.on_event("registered", self._on_registered)
-        self.janus.on_event("registration_failed", self._on_registration_failed)
-        self.janus.on_event("incomingcall", self._on_incoming_call)
-        self.janus.on_event("accepted", self._on_call_accepted)
-        self.janus.on_event("hangup", self._on_hangup)
-        self.janus.on_event("calling", self._on_calling)
-        self.janus.on_event("ringing", self._on_ringing)
+        self.janus.set_event_map(self, self.EVENT_HANDLERS)
 
     # ── HANDLERS SIP ─────────────────────────────────────
 
     async def _on_registered(self, data):
         """Registro exitoso en la UCM6302."""
-        pd = data.get("plugindata", {}).get("data", {})
-        username = pd.get("result", {}).get("username", SIP_EXTENSION)
+        username = _result(data).get("username", SIP_EXTENSION)
         logger.success(f"✅ Registrado como {username} en la UCM6302")
         logger.info(f"   Listo para recibir llamadas en ext {SIP_EXTENSION}")
 
     async def _on_registration_failed(self, data):
         """Error en el registro SIP."""
-        pd = data.get("plugindata", {}).get("data", {})
-        result = pd.get("result", {})
+        result = _result(data)
         logger.error(f"❌ Registro fallido: {result.get('code')} - {result.get('reason')}")
         logger.error("   Verifica: extensión, contraseña, IP de la UCM, puertos")
 
@@ -144,8 +248,7 @@ class VoiceAgentService:
           3. Abrir sesión Deepgram Voice Agent
           4. Iniciar bridge de audio
         """
-        pd = data.get("plugindata", {}).get("data", {})
-        result = pd.get("result", {})
+        result = _result(data)
         caller = result.get("username", result.get("displayname", "desconocido"))
         jsep = data.get("jsep")  # SDP offer del llamante
 
@@ -163,15 +266,23 @@ class VoiceAgentService:
             logger.info("Aceptando llamada...")
             await self.janus.accept_call()
 
-            # Iniciar sesión Deepgram Voice Agent para esta llamada
-            logger.info("Iniciando sesión Deepgram Voice Agent...")
-            self.deepgram = DeepgramVoiceAgent()
-
-            # Configurar callbacks de Deepgram
-            self._setup_deepgram_callbacks()
-
-            # Conectar a Deepgram
-            await self.deepgram.connect()
+            # Sesión Deepgram para esta llamada: del pool si hay una lista,
+            # si no se conecta una nueva
+            agent = await self._take_dg_agent()
+            if agent:
+                logger.info("Usando sesión Deepgram pre-conectada...")
+                self.deepgram = agent
+                self._setup_deepgram_callbacks()
+                await self.deepgram.greet()
+            else:
+                logger.info("Iniciando sesión Deepgram Voice Agent...")
+                self.deepgram = DeepgramVoiceAgent(_env)
+                self._setup_deepgram_callbacks()
+                await self.deepgram.connect()
+            self._refill_dg_pool()
+
+            # Emitir el audio TTS hacia el llamante a ritmo de ptime
+            self._pacer_task = asyncio.create_task(self._rtp_pacer())
 
             logger.success(f"✅ Llamada activa con {caller} - Deepgram conectado")
             logger.info("   Audio: Llamante → Janus → [bridge] → Deepgram → [bridge] → Janus → Llamante")
@@ -199,19 +310,82 @@ class VoiceAgentService:
         """Llamada finalizada."""
         reason = "desconocido"
         if isinstance(data, dict):
-            pd = data.get("plugindata", {}).get("data", {})
-            reason = pd.get("result", {}).get("reason", data.get("reason", "desconocido"))
+            reason = _result(data).get("reason", data.get("reason", "desconocido"))
 
         logger.info(f"📴 Llamada finalizada: {reason}")
 
+        self._stop_pacer()
+
         # Cerrar sesión Deepgram
         if self.deepgram:
             await self.deepgram.disconnect()
             self.deepgram = None
 
+        self._tts_reset()
         self.in_call = False
+
+        # Las sesiones Deepgram no se reutilizan entre llamadas (no hay
+        # reset de conversación): se repone el pool con una nueva
+        self._refill_dg_pool()
         logger.info("Esperando nueva llamada...")
 
+    # ── POOL DEEPGRAM ────────────────────────────────────
+
+    async def _warm_dg_pool(self):
+        """Conectar (en paralelo) las sesiones que faltan en el pool."""
+        while self._dg_closed:
+            await self._dg_closed.pop().disconnect()
+        missing = DEEPGRAM_POOL_SIZE - len(self._dg_pool)
+        if missing <= 0:
+            return
+        agents = [DeepgramVoiceAgent(_env) for _ in range(missing)]
+        try:
+            results = await asyncio.gather(
+                *(a.connect(defer_greeting=True) for a in agents),
+                return_exceptions=True,
+            )
+        except asyncio.CancelledError:
+            # Apagado a mitad del warm-up: cerrar las sesiones que ya
+            # conectaron (las demás se limpian en su propio connect())
+            await asyncio.gather(
+                *(a.disconnect() for a in agents if a.connected),
+                return_exceptions=True,
+            )
+            raise
+        for agent, res in zip(agents, results):
+            if isinstance(res, BaseException):
+                logger.warning(f"No se pudo pre-conectar sesión Deepgram: {res}")
+            else:
+                agent.on_close(lambda agent=agent: self._on_pool_agent_closed(agent))
+                self._dg_pool.append(agent)
+        logger.info(f"Pool Deepgram: {len(self._dg_pool)}/{DEEPGRAM_POOL_SIZE} sesiones listas")
+
+    def _on_pool_agent_closed(self, agent: DeepgramVoiceAgent):
+        """Deepgram cerró una sesión del pool mientras esperaba: reponerla ya."""
+        if agent not in self._dg_pool:
+            return  # ya asignada a una llamada
+        self._dg_pool.remove(agent)
+        self._dg_closed.append(agent)
+        logger.warning("Sesión Deepgram del pool cerrada por el servidor, reponiendo...")
+        self._refill_dg_pool()
+
+    def _refill_dg_pool(self):
+        """Reponer el pool en segundo plano (una sola reposición a la vez)."""
+        if self._shutdown_started or (self._pool_task and not self._pool_task.done()):
+            return
+        self._pool_task = asyncio.create_task(self._warm_dg_pool())
+
+    async def _take_dg_agent(self):
+        """Sacar una sesión viva del pool (None si no hay)."""
+        while self._dg_pool:
+            agent = self._dg_pool.pop()
+            if agent.connected:
+                return agent
+            # Deepgram cerró la sesión mientras esperaba: liberar recursos
+            # (el socket ya está cerrado, así que no tarda)
+            await agent.disconnect()
+        return None
+
     # ── CALLBACKS DEEPGRAM ───────────────────────────────
 
     def _setup_deepgram_callbacks(self):
@@ -236,14 +410,131 @@ class VoiceAgentService:
         """
         Audio PCM de respuesta del agente recibido de Deepgram.
 
-        TODO: En producción, este audio debe inyectarse en el
+        Se acumula en el buffer circular; _rtp_pacer lo saca en
+        frames de ptime hacia el llamante.
+        """
+        # Camino de audio (50 frames/s): usar siempre la forma lazy de loguru
+        # logger.opt(lazy=True).debug("Audio DG: {} bytes", lambda: len(audio_data))
+        self._tts_push(audio_data)
+
+    def _tts_push(self, data: bytes):
+        """Escribir audio en el buffer circular, descartando lo más antiguo si no cabe."""
+        cap = len(self._tts_ring)
+        src = memoryview(data)
+        n = len(src)
+        dropped = 0
+        if n >= cap:
+            # Más audio que capacidad: solo importan los últimos `cap` bytes
+            dropped = n - cap
+            src = src[dropped:]
+            n = cap
+
+        overflow = self._tts_size + n - cap
+        if overflow > 0:
+            self._tts_head = (self._tts_head + overflow) % cap
+            self._tts_size -= overflow
+            dropped += overflow
+        if dropped:
+            logger.opt(lazy=True).debug(
+                "Buffer TTS lleno: {} bytes de audio descartados", lambda: dropped)
+
+        tail = self._tts_tail
+        first = min(n, cap - tail)
+        self._tts_view[tail:tail + first] = src[:first]
+        if first < n:
+            self._tts_view[:n - first] = src[first:]
+        self._tts_tail = (tail + n) % cap
+        self._tts_size += n
+
+    def _tts_pop(self, n: int):
+        """Leer exactamente `n` bytes del buffer circular (None si no hay suficientes)."""
+        if self._tts_size < n:
+            return None
+        cap = len(self._tts_ring)
+        head = self._tts_head
+        end = head + n
+        if end <= cap:
+            frame = bytes(self._tts_view[head:end])
+        else:
+            frame = bytes(self._tts_view[head:]) + bytes(self._tts_view[:end - cap])
+        self._tts_head = end % cap
+        self._tts_size -= n
+        return frame
+
+    def _tts_reset(self):
+        """Vaciar el buffer circular (fin de llamada)."""
+        self._tts_head = self._tts_tail = self._tts_size = 0
+
+    async def _rtp_pacer(self):
+        """
+        Sacar un frame de ptime del buffer TTS en cada tick.
+
+        Un envío por tick (no uno por chunk de Deepgram), con deadlines
+        absolutos para que el ritmo no derive con la latencia del loop.
+        """
+        loop = asyncio.get_running_loop()
+        ptime = RTP_PTIME_MS / 1000
+        deadline = loop.time()
+        while True:
+            deadline += ptime
+            delay = deadline - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            elif delay < -ptime:
+                # Loop bloqueado más de un frame: re-sincronizar en vez
+                # de emitir una ráfaga para recuperar el retraso
+                deadline = loop.time()
+
+            frame = self._tts_pop(self._tts_frame_bytes)
+            if frame is not None:
+                try:
+                    await self._send_rtp_frame(frame)
+                except Exception as e:
+                    logger.error(f"Error enviando audio al llamante: {e}")
+
+    def _stop_pacer(self):
+        if self._pacer_task:
+            self._pacer_task.cancel()
+            self._pacer_task = None
+
+    def set_rtp_sink(self, sink):
+        """
+        Registrar el destino del audio hacia el llamante.
+
+        Args:
+            sink: Corrutina que recibe cada payload G.711 (un frame de ptime)
+
+        TODO: En producción, el sink debe inyectar el audio en el
         flujo RTP de Janus hacia el llamante. Esto requiere:
           - Capturar el track de audio del PeerConnection
-          - Convertir PCM al codec negociado (PCMU/PCMA/opus)
-          - Enviar como paquetes RTP via el data channel o track
+          - Enviar el payload como paquetes RTP via el data channel o track
         """
-        # logger.debug(f"Audio de Deepgram: {len(audio_data)} bytes")
-        pass  # Integrar con el pipeline RTP de Janus
+        self._rtp_sink = sink
+
+    async def _send_rtp_frame(self, frame: bytes):
+        """
+        Entregar un frame de audio (ptime) al llamante.
+
+        Se convierte a G.711 (RTP_CODEC) solo si hay un sink registrado:
+        sin bridge RTP el frame se descarta sin gastar CPU.
+        """
+        if self._rtp_sink is None:
+            return
+        payload = g711.encode(frame, RTP_CODEC, AUDIO_SAMPLE_RATE) if TRANSCODE_G711 else frame
+        await self._rtp_sink(payload)
+
+    async def _on_rtp_audio(self, payload: bytes):
+        """
+        Audio RTP del llamante (payload G.711) → Deepgram.
+
+        Punto de entrada para la captura RTP (ver README, bridge de audio):
+        el payload se decodifica a PCM16 (a AUDIO_SAMPLE_RATE) si Deepgram
+        trabaja en linear16.
+        """
+        if not self.deepgram:
+            return
+        pcm = g711.decode(payload, RTP_CODEC, AUDIO_SAMPLE_RATE) if TRANSCODE_G711 else payload
+        await self.deepgram.send_audio(pcm)
 
     async def _on_user_transcript(self, text: str):
         """El usuario dijo algo (transcripción de Deepgram)."""
@@ -263,13 +554,33 @@ class VoiceAgentService:
 
     # ── SHUTDOWN ─────────────────────────────────────────
 
+    def stop(self):
+        """Solicitar la parada del servicio (seguro desde un signal handler)."""
+        self._stop_event.set()
+        # Si aún está arrancando, no esperar a que termine el registro
+        if self._startup_task is not None and not self._startup_task.done():
+            self._startup_task.cancel()
+
     async def shutdown(self):
-        """Apagar el servicio limpiamente."""
+        """Apagar el servicio limpiamente (solo la primera llamada tiene efecto)."""
+        if self._shutdown_started:
+            return
+        self._shutdown_started = True
+
         logger.info("Apagando servicio...")
-        self.running = False
+        self._stop_event.set()
+        self._stop_pacer()
 
+        if self._pool_task:
+            # Esperar a que el warm-up cancelado cierre lo que ya conectó
+            self._pool_task.cancel()
+            await asyncio.gather(self._pool_task, return_exceptions=True)
         if self.deepgram:
             await self.deepgram.disconnect()
+        for agent in self._dg_pool + self._dg_closed:
+            await agent.disconnect()
+        self._dg_pool.clear()
+        self._dg_closed.clear()
 
         try:
             await self.janus.hangup()
@@ -285,18 +596,25 @@ class VoiceAgentService:
 async def main():
     service = VoiceAgentService()
 
-    loop = asyncio.get_event_loop()
+    # El handler solo marca la parada (sin closure ni Task); el apagado
+    # real lo hace una única vez el finally de start(). Reemplaza también
+    # el KeyboardInterrupt de SIGINT.
+    loop = asyncio.get_running_loop()
     for sig in (signal.SIGINT, signal.SIGTERM):
-        loop.add_signal_handler(sig, lambda: asyncio.create_task(service.shutdown()))
+        loop.add_signal_handler(sig, service.stop)
 
     try:
         await service.start()
-    except KeyboardInterrupt:
-        await service.shutdown()
     except Exception as e:
         logger.error(f"Error fatal: {e}")
         await service.shutdown()
 
 
 if __name__ == "__main__":
+    # uvloop reemplaza el event loop por defecto por uno basado en libuv:
+    # menor costo por evento en los loops WebSocket de Janus y Deepgram.
+    # Desactivable con USE_UVLOOP=0 (p. ej. para depurar con el loop estándar).
+    if uvloop is not None and USE_UVLOOP:
+        logger.info("Usando event loop uvloop")
+        uvloop.install()
     asyncio.run(main())